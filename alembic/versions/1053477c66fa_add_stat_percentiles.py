@@ -0,0 +1,36 @@
+"""add stat percentiles
+
+Revision ID: 1053477c66fa
+Revises: a5a0c41e9f6d
+Create Date: 2026-10-19 15:58:31.470922
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1053477c66fa'
+down_revision: Union[str, Sequence[str], None] = 'a5a0c41e9f6d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stat_percentiles',
+    sa.Column('part', sa.Integer(), nullable=False),
+    sa.Column('stat', sa.String(), nullable=False),
+    sa.Column('percentile', sa.Integer(), nullable=False),
+    sa.Column('tier', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['part'], ['parts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('part', 'stat')
+    )
+    # Ranks start empty, fill them with `python percentiles.py` after upgrading
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('stat_percentiles')
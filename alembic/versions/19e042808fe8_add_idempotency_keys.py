@@ -0,0 +1,38 @@
+"""add idempotency keys
+
+Revision ID: 19e042808fe8
+Revises: c3fccc7f0f20
+Create Date: 2026-10-19 11:03:47.902615
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '19e042808fe8'
+down_revision: Union[str, Sequence[str], None] = 'c3fccc7f0f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('idempotency_keys',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('owner', sa.Integer(), nullable=True),
+    sa.Column('part', sa.Integer(), nullable=True),
+    sa.Column('created_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['owner'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['part'], ['parts.id'], ),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_idempotency_keys_key'), 'idempotency_keys', ['key'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_idempotency_keys_key'), table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
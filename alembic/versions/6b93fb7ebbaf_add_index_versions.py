@@ -0,0 +1,36 @@
+"""add index versions
+
+Revision ID: 6b93fb7ebbaf
+Revises: 1053477c66fa
+Create Date: 2026-10-20 09:47:15.602381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b93fb7ebbaf'
+down_revision: Union[str, Sequence[str], None] = '1053477c66fa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    index_versions = op.create_table('index_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(index_versions, [
+        {'name': 'catalog', 'version': 0},
+        {'name': 'ownership', 'version': 0},
+    ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('index_versions')
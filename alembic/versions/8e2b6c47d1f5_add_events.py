@@ -0,0 +1,37 @@
+"""add events
+
+Revision ID: 8e2b6c47d1f5
+Revises: d41f7a2c9e83
+Create Date: 2026-10-21 14:03:55.172940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2b6c47d1f5'
+down_revision: Union[str, Sequence[str], None] = 'd41f7a2c9e83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('origin', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('payload', sa.String(), nullable=False),
+    sa.Column('created_date', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_events_created_date'), 'events', ['created_date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_events_created_date'), table_name='events')
+    op.drop_table('events')
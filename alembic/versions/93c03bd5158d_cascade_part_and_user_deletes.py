@@ -0,0 +1,65 @@
+"""cascade part and user deletes
+
+Revision ID: 93c03bd5158d
+Revises: 19e042808fe8
+Create Date: 2026-10-19 12:26:10.554871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '93c03bd5158d'
+down_revision: Union[str, Sequence[str], None] = '19e042808fe8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, referenced table, ondelete)
+FOREIGN_KEYS = [
+    ('ownerships', 'owner', 'users', 'CASCADE'),
+    ('ownerships', 'part', 'parts', 'CASCADE'),
+    ('parts', 'stats', 'stats', 'SET NULL'),
+    ('parts', 'restriction', 'restrictions', 'SET NULL'),
+    ('stats', 'id', 'parts', 'CASCADE'),
+    ('combos', 'lock_chip', 'parts', 'SET NULL'),
+    ('combos', 'main_blade', 'parts', 'SET NULL'),
+    ('combos', 'assis_blade', 'parts', 'SET NULL'),
+    ('combos', 'ratchet', 'parts', 'SET NULL'),
+    ('combos', 'bit', 'parts', 'SET NULL'),
+    ('part_popularity', 'part', 'parts', 'CASCADE'),
+    ('idempotency_keys', 'owner', 'users', 'CASCADE'),
+    ('idempotency_keys', 'part', 'parts', 'SET NULL'),
+]
+
+
+# Gives the unnamed ForeignKeys in models.py their Postgres default names, so SQLite's
+# reflected (nameless) constraints can be dropped by the same name in batch mode
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def _replace_foreign_keys(with_ondelete: bool) -> None:
+    tables = {}
+    for table, column, referent, ondelete in FOREIGN_KEYS:
+        tables.setdefault(table, []).append((column, referent, ondelete))
+    for table, foreign_keys in tables.items():
+        # Postgres alters in place, SQLite can't alter constraints and gets the table recreated
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referent, ondelete in foreign_keys:
+                name = f'{table}_{column}_fkey'
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(
+                    name, referent, [column], ['id'],
+                    ondelete=ondelete if with_ondelete else None,
+                )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _replace_foreign_keys(with_ondelete=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _replace_foreign_keys(with_ondelete=False)
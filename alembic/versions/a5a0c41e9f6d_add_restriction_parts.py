@@ -0,0 +1,34 @@
+"""add restriction parts
+
+Revision ID: a5a0c41e9f6d
+Revises: 93c03bd5158d
+Create Date: 2026-10-19 14:41:22.806143
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5a0c41e9f6d'
+down_revision: Union[str, Sequence[str], None] = '93c03bd5158d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('restriction_parts',
+    sa.Column('restriction', sa.Integer(), nullable=False),
+    sa.Column('part', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['restriction'], ['restrictions.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['part'], ['parts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('restriction', 'part')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('restriction_parts')
@@ -0,0 +1,43 @@
+"""add part popularity
+
+Revision ID: c3fccc7f0f20
+Revises: 6ad9e0519a43
+Create Date: 2026-10-19 10:12:04.318210
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3fccc7f0f20'
+down_revision: Union[str, Sequence[str], None] = '6ad9e0519a43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('part_popularity',
+    sa.Column('part', sa.Integer(), nullable=False),
+    sa.Column('part_type', sa.Integer(), nullable=True),
+    sa.Column('owned_count', sa.Integer(), nullable=False),
+    sa.Column('combo_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['part'], ['parts.id'], ),
+    sa.ForeignKeyConstraint(['part_type'], ['part_types.id'], ),
+    sa.PrimaryKeyConstraint('part')
+    )
+    op.create_index(op.f('ix_part_popularity_part'), 'part_popularity', ['part'], unique=False)
+    op.create_index('ix_part_popularity_type_owned', 'part_popularity', ['part_type', 'owned_count'], unique=False)
+    op.create_index('ix_part_popularity_type_combo', 'part_popularity', ['part_type', 'combo_count'], unique=False)
+    # Counters start empty, fill them with `python popularity.py` after upgrading
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_part_popularity_type_combo', table_name='part_popularity')
+    op.drop_index('ix_part_popularity_type_owned', table_name='part_popularity')
+    op.drop_index(op.f('ix_part_popularity_part'), table_name='part_popularity')
+    op.drop_table('part_popularity')
@@ -0,0 +1,30 @@
+"""add idempotency request hash
+
+Revision ID: d41f7a2c9e83
+Revises: 6b93fb7ebbaf
+Create Date: 2026-10-21 10:12:38.419027
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f7a2c9e83'
+down_revision: Union[str, Sequence[str], None] = '6b93fb7ebbaf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_keys', sa.Column('request_hash', sa.String(), nullable=True))
+    op.create_index(op.f('ix_idempotency_keys_created_date'), 'idempotency_keys', ['created_date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_idempotency_keys_created_date'), table_name='idempotency_keys')
+    op.drop_column('idempotency_keys', 'request_hash')
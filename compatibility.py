@@ -0,0 +1,139 @@
+import threading
+from sqlalchemy.orm import Session
+import models
+import versions
+
+# Bitsets are plain ints with one bit per part id.
+# A part carrying restriction R can't share a combo with any part listed under R.
+
+def bits(bitset: int):
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+class CompatibilityIndex(versions.VersionedIndex):
+    version_name = versions.CATALOG
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.known = 0
+        self.type_mask = {}
+        self.part_type = {}
+        self.part_restriction = {}
+        self.excluded = {}
+        self.carriers = {}
+        self.incompatible = {}
+
+    def load(self, db: Session):
+        # Read the version first, a write landing mid-load just triggers another reload
+        version = versions.read(db, self.version_name)
+        with self.lock:
+            self._reset()
+            for part_id, type_id, restriction_id in db.query(models.Parts.id, models.Parts.type, models.Parts.restriction):
+                self._place(part_id, type_id, restriction_id)
+            for restriction_id, part_id in db.query(models.RestrictionParts.restriction, models.RestrictionParts.part):
+                self.excluded[restriction_id] = self.excluded.get(restriction_id, 0) | (1 << part_id)
+            for part_id in bits(self.known):
+                self._compile(part_id)
+            self.version = version
+
+    def _place(self, part_id, type_id, restriction_id):
+        bit = 1 << part_id
+        self.known |= bit
+        self.part_type[part_id] = type_id
+        self.type_mask[type_id] = self.type_mask.get(type_id, 0) | bit
+        self.part_restriction[part_id] = restriction_id
+        if restriction_id is not None:
+            self.carriers[restriction_id] = self.carriers.get(restriction_id, 0) | bit
+
+    def _unplace(self, part_id):
+        clear = ~(1 << part_id)
+        self.known &= clear
+        type_id = self.part_type.pop(part_id, None)
+        if type_id in self.type_mask:
+            self.type_mask[type_id] &= clear
+        restriction_id = self.part_restriction.pop(part_id, None)
+        if restriction_id in self.carriers:
+            self.carriers[restriction_id] &= clear
+        self.incompatible.pop(part_id, None)
+        return restriction_id
+
+    def _compile(self, part_id):
+        bit = 1 << part_id
+        incompatible = self.excluded.get(self.part_restriction.get(part_id), 0)
+        for restriction_id, excluded in self.excluded.items():
+            if excluded & bit:
+                incompatible |= self.carriers.get(restriction_id, 0)
+        self.incompatible[part_id] = incompatible & self.known & ~bit
+
+    def _recompile(self, affected: int):
+        for part_id in bits(affected & self.known):
+            self._compile(part_id)
+
+    def set_part(self, part_id: int, type_id: int, restriction_id=None):
+        with self.lock:
+            old_restriction = self._unplace(part_id)
+            self._place(part_id, type_id, restriction_id)
+            self._recompile(
+                (1 << part_id)
+                | self.excluded.get(old_restriction, 0)
+                | self.excluded.get(restriction_id, 0)
+            )
+
+    def remove_part(self, part_id: int):
+        with self.lock:
+            restriction_id = self._unplace(part_id)
+            bit = 1 << part_id
+            # Carriers of restrictions that listed the part still have its bit set
+            affected = self.excluded.get(restriction_id, 0)
+            for excluded_id, excluded in self.excluded.items():
+                if excluded & bit:
+                    affected |= self.carriers.get(excluded_id, 0)
+                    self.excluded[excluded_id] = excluded & ~bit
+            self._recompile(affected)
+
+    def add_rule(self, restriction_id: int, part_id: int):
+        with self.lock:
+            self.excluded[restriction_id] = self.excluded.get(restriction_id, 0) | (1 << part_id)
+            self._recompile((1 << part_id) | self.carriers.get(restriction_id, 0))
+
+    def remove_rule(self, restriction_id: int, part_id: int):
+        with self.lock:
+            self.excluded[restriction_id] = self.excluded.get(restriction_id, 0) & ~(1 << part_id)
+            self._recompile((1 << part_id) | self.carriers.get(restriction_id, 0))
+
+    def remove_restriction(self, restriction_id: int):
+        with self.lock:
+            affected = self.excluded.pop(restriction_id, 0) | self.carriers.get(restriction_id, 0)
+            for part_id in bits(self.carriers.pop(restriction_id, 0)):
+                self.part_restriction[part_id] = None
+            self._recompile(affected)
+
+    def compatible(self, part_id: int, type_id=None):
+        incompatible = self.incompatible.get(part_id, 0) | (1 << part_id)
+        if type_id is not None:
+            return list(bits(self.type_mask.get(type_id, 0) & ~incompatible))
+        return {
+            type_id: list(bits(mask & ~incompatible))
+            for type_id, mask in self.type_mask.items() if mask
+        }
+
+    def check(self, part_ids):
+        """Returns (unknown part ids, incompatible pairs) for one combo."""
+        combo = 0
+        for part_id in part_ids:
+            combo |= 1 << part_id
+        unknown = list(bits(combo & ~self.known))
+        conflicts = []
+        for part_id in bits(combo & self.known):
+            for other in bits(self.incompatible.get(part_id, 0) & combo):
+                if part_id < other:
+                    conflicts.append((part_id, other))
+        return unknown, conflicts
+
+index = CompatibilityIndex()
@@ -1,7 +1,14 @@
 import json
-with open('values.json') as f:
+import os
+# VALUES_PATH points at another values.json, the tests use a throwaway one
+with open(os.environ.get('VALUES_PATH', 'values.json')) as f:
     config = json.load(f)
 
 db_path = config["db_path"]
+replica_db_path = config.get("replica_db_path")
+replica_retry_seconds = config.get("replica_retry_seconds", 30)
+snapshot_dir = config.get("snapshot_dir")
+index_refresh_seconds = config.get("index_refresh_seconds", 2)
+idempotency_key_hours = config.get("idempotency_key_hours", 24)
 jwt_secret = config["jwt_secret"]
 port = config["port"]
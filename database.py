@@ -1,10 +1,53 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from config import db_path
+from config import db_path, replica_db_path, replica_retry_seconds
 
 URL_DATABASE = db_path
 
-engine = create_engine(URL_DATABASE)
+# SQLite ignores ON DELETE clauses unless foreign keys are switched on per connection.
+# Tables created before migration 93c03bd5158d have no ON DELETE rules, enforcing their
+# foreign keys would turn part and user deletes into errors, so they stay off until upgraded.
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    rules = cursor.execute("PRAGMA foreign_key_list(ownerships)").fetchall()
+    # Column 6 is on_delete, a fresh database has no tables yet and gets them from models.py
+    if all(rule[6] == "CASCADE" for rule in rules):
+        cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def make_engine(url, **kwargs):
+    new_engine = create_engine(url, **kwargs)
+    if new_engine.dialect.name == "sqlite":
+        event.listen(new_engine, "connect", enable_sqlite_foreign_keys)
+    return new_engine
+
+engine = make_engine(URL_DATABASE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+# Optional read replica, GET handlers read from it and everything else stays on the primary
+replica_engine = make_engine(replica_db_path, pool_pre_ping=True) if replica_db_path else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+
+# Callers who wrote recently keep reading from the primary until the replica has caught up.
+# The pin travels with the client (see track_writes in main.py), so every worker honours it.
+READ_YOUR_WRITES_SECONDS = 5
+_replica_down_until = 0.0
+
+def read_session(pinned: bool = False):
+    global _replica_down_until
+    now = time.monotonic()
+    if ReplicaSessionLocal is None or pinned or now < _replica_down_until:
+        return SessionLocal()
+    db = ReplicaSessionLocal()
+    try:
+        db.connection()
+    except OperationalError:
+        # Fail over to the primary and leave the replica alone for a while
+        db.close()
+        _replica_down_until = now + replica_retry_seconds
+        return SessionLocal()
+    return db
\ No newline at end of file
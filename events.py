@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+import models
+from database import SessionLocal
+
+QUEUE_SIZE = 100
+# Sent in place of everything a subscriber missed, clients should refetch on it
+RESYNC = json.dumps({"e": "resync"}, separators=(",", ":"))
+# Each worker only holds its own sockets. Published events are also written to the events
+# table, and every worker relays the rows other workers wrote to its subscribers.
+WORKER = uuid.uuid4().hex
+RELAY_SECONDS = 1.0
+PRUNE_SECONDS = 60
+KEEP_MINUTES = 5
+
+logger = logging.getLogger(__name__)
+
+class Subscriber:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def offer(self, message: str):
+        if self.queue.full():
+            # A slow client loses its backlog instead of holding up everyone else
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RESYNC
+        self.queue.put_nowait(message)
+
+def _record(message: str, user_id):
+    db = SessionLocal()
+    try:
+        db.add(models.Events(origin=WORKER, user_id=user_id, payload=message))
+        db.commit()
+    except SQLAlchemyError:
+        # The write it describes is already committed, only other workers' sockets miss it
+        logger.exception("Recording event failed")
+    finally:
+        db.close()
+
+def _poll(last_id, prune: bool):
+    """Returns the newest event id and the other workers' events after last_id."""
+    db = SessionLocal()
+    try:
+        if prune:
+            db.execute(delete(models.Events).where(models.Events.created_date < datetime.now() - timedelta(minutes=KEEP_MINUTES)))
+            db.commit()
+        if last_id is None:
+            return db.query(func.max(models.Events.id)).scalar() or 0, []
+        rows = (
+            db.query(models.Events.id, models.Events.origin, models.Events.user_id, models.Events.payload)
+            .filter(models.Events.id > last_id)
+            .order_by(models.Events.id)
+            .all()
+        )
+        if rows:
+            last_id = rows[-1].id
+        return last_id, [row for row in rows if row.origin != WORKER]
+    finally:
+        db.close()
+
+class Broadcaster:
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber(user_id)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: dict, user_id=None):
+        message = json.dumps(event, separators=(",", ":"))
+        _record(message, user_id)
+        # Called from sync handlers running in the threadpool, so hop onto the event loop
+        if not self.subscribers or self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._fan_out, message, user_id)
+
+    def _fan_out(self, message: str, user_id):
+        for subscriber in list(self.subscribers):
+            if user_id is None or subscriber.user_id == user_id:
+                subscriber.offer(message)
+
+    async def relay(self):
+        """Forwards other workers' events to this worker's subscribers, runs for the app's lifetime."""
+        self.loop = asyncio.get_running_loop()
+        last_id = None
+        pruned = 0.0
+        failed = False
+        while True:
+            prune = time.monotonic() - pruned > PRUNE_SECONDS
+            try:
+                last_id, rows = await run_in_threadpool(_poll, last_id, prune)
+            except SQLAlchemyError:
+                logger.exception("Relaying events failed")
+                failed = True
+            else:
+                if failed:
+                    # Rows may have been pruned meanwhile, clients refetch rather than trust the gap
+                    self._fan_out(RESYNC, None)
+                    failed = False
+                if prune:
+                    pruned = time.monotonic()
+                for row in rows:
+                    self._fan_out(row.payload, row.user_id)
+            await asyncio.sleep(RELAY_SECONDS)
+
+broadcaster = Broadcaster()
+
+def catalog_changed(kind: str, op: str, **fields):
+    broadcaster.publish({"e": kind, "op": op, **fields})
+
+def ownership_changed(user_id: int, op: str, part_id: int):
+    broadcaster.publish({"e": "ownership", "op": op, "part": part_id}, user_id=user_id)
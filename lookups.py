@@ -0,0 +1,35 @@
+from sqlalchemy.orm import Session
+import models
+
+# Types and restrictions change rarely, so resolved IDs are kept per worker.
+# Misses are never cached, deletes must call forget_type/forget_restriction.
+_type_ids = {}
+_restriction_ids = set()
+
+def type_id(db: Session, name: str):
+    if name not in _type_ids:
+        found = db.query(models.PartTypes.id).filter(models.PartTypes.name == name).scalar()
+        if found is None:
+            return None
+        _type_ids[name] = found
+    return _type_ids[name]
+
+def restriction_exists(db: Session, restriction_id: int) -> bool:
+    if restriction_id not in _restriction_ids:
+        found = db.query(models.Restrictions.id).filter(models.Restrictions.id == restriction_id).scalar()
+        if found is None:
+            return False
+        _restriction_ids.add(found)
+    return True
+
+def forget_type(type_id: int):
+    for name, cached in list(_type_ids.items()):
+        if cached == type_id:
+            del _type_ids[name]
+
+def forget_restriction(restriction_id: int):
+    _restriction_ids.discard(restriction_id)
+
+def clear():
+    _type_ids.clear()
+    _restriction_ids.clear()
@@ -1,15 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Annotated, Optional
 import models
+import database
 from database import SessionLocal, engine
 from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, union, or_
+from sqlalchemy.exc import IntegrityError
 from models import Users
 import auth
+import popularity
+import lookups
+import events
+import compatibility
+import percentiles
+import similarity
+import trades
+import snapshot
+import versions
 from auth import get_current_user
+from config import idempotency_key_hours
 from fastapi.openapi.utils import get_openapi
 
-app = FastAPI()
+def load_indexes():
+    db = SessionLocal()
+    try:
+        versions.ensure(db)
+        compatibility.index.load(db)
+        similarity.index.load(db)
+        trades.index.load(db)
+        if snapshot.current(db) is None:
+            # Missing, behind the catalog or left by an older format
+            snapshot.publish()
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(load_indexes)
+    relay = asyncio.create_task(events.broadcaster.relay())
+    yield
+    relay.cancel()
+
+app = FastAPI(lifespan=lifespan)
 models.Base.metadata.create_all(bind=engine)
 app.include_router(auth.router)
 
@@ -110,12 +149,20 @@ class Stat_In(BaseModel):
     burst: int
     dash: int
 
+class Percentile_Out(BaseModel):
+    stat: str
+    percentile: int
+    tier: str
+    class Config:
+        from_attributes = True
+
 class Part_Out(BaseModel):
     id: int
     name: str
     type: int
     stats: Stat_Out
     restriction: Optional[Restriction_Out] = None
+    percentiles: List[Percentile_Out] = []
     class Config:
         from_attributes = True
 
@@ -125,6 +172,12 @@ class Part_In(BaseModel):
     stats: Stat_In
     restriction: Optional[Restriction_In] = None
 
+# Either ids, or type and/or line (both given means parts matching both)
+class Part_Bulk_Delete(BaseModel):
+    ids: Optional[List[int]] = None
+    type: Optional[int] = None
+    line: Optional[int] = None
+
 class Line_Out(BaseModel):
     id: int
     name: str
@@ -146,6 +199,22 @@ class Combo_Out(BaseModel):
     class Config:
         from_attributes = True
 
+class Popularity_Out(BaseModel):
+    part: int
+    name: str
+    count: int
+
+class Similar_Out(BaseModel):
+    part: int
+    name: str
+    distance: float
+
+class Trade_Out(BaseModel):
+    user: int
+    username: str
+    give: List[int]
+    get: List[int]
+
 class Combo_In(BaseModel):
     isStock: bool
     line: int
@@ -165,12 +234,106 @@ def get_db():
 
 db_dependency = Annotated[Session, Depends(get_db)]
 
+READ_PRIMARY = "read-primary-until"
+
+def read_primary_pinned(request: Request) -> bool:
+    pinned_until = request.cookies.get(READ_PRIMARY) or request.headers.get(READ_PRIMARY)
+    try:
+        return float(pinned_until) > time.time()
+    except (TypeError, ValueError):
+        return False
+
+def get_read_db(request: Request):
+    db = database.read_session(read_primary_pinned(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+read_db_dependency = Annotated[Session, Depends(get_read_db)]
+
+def get_read_user(db: read_db_dependency, token: str = Depends(auth.oauth2_bearer)):
+    # Read routes authenticate through their own read session, so a GET served by the
+    # replica doesn't also hold a primary connection for the users lookup
+    try:
+        return get_current_user(token, db)
+    except HTTPException as error:
+        if error.status_code != 404 or db.get_bind() is engine:
+            raise
+    # Accounts registered moments ago may not have reached the replica yet
+    primary = SessionLocal()
+    try:
+        return get_current_user(token, primary)
+    finally:
+        primary.close()
+
+def catalog_applied(version):
+    compatibility.index.applied(version)
+    similarity.index.applied(version)
+
+# Every write that bumps versions.CATALOG publishes, served snapshots behind it are skipped
+def publish_catalog(kind: str, op: str, **fields):
+    snapshot.publish()
+    events.catalog_changed(kind, op, **fields)
+
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    response = await call_next(request)
+    # Successful writes pin the caller's reads to the primary for a few seconds. The pin is
+    # returned as a cookie and a header (for clients without cookies to echo back), so it
+    # holds whichever worker serves the next read.
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400 and request.headers.get("Authorization"):
+        pinned_until = f"{time.time() + database.READ_YOUR_WRITES_SECONDS:.3f}"
+        response.set_cookie(READ_PRIMARY, pinned_until, max_age=database.READ_YOUR_WRITES_SECONDS, httponly=True, samesite="lax")
+        response.headers[READ_PRIMARY] = pinned_until
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
+def websocket_user(token: str):
+    db = SessionLocal()
+    try:
+        return get_current_user(token, db)
+    finally:
+        db.close()
+
+@app.websocket("/ws")
+async def changes(websocket: WebSocket, token: Optional[str] = None):
+    # Browsers can't set headers on a WebSocket, so the JWT may also come as ?token=
+    authorization = websocket.headers.get("Authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    try:
+        user = await run_in_threadpool(websocket_user, token or "")
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscriber = events.broadcaster.subscribe(user.id)
+
+    async def send():
+        while True:
+            await websocket.send_text(await subscriber.queue.get())
+
+    async def receive():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        events.broadcaster.unsubscribe(subscriber)
+        for task in tasks:
+            task.cancel()
+
 @app.get("/me", response_model= User_Out,tags=["Users"])
-def get_me(db: db_dependency, current_user: Users = Depends(get_current_user)):
+def get_me(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
     user = db.query(models.Users).filter(models.Users.id == current_user.id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -179,7 +342,7 @@ def get_me(db: db_dependency, current_user: Users = Depends(get_current_user)):
     return user
 
 @app.get("/Users/", tags=["Users"])
-async def get_users(db: db_dependency, current_user: Users = Depends(get_current_user)):
+async def get_users(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
     if current_user.user_type != 1: # type: ignore
         raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
     result = db.query(models.Users).all()
@@ -191,11 +354,15 @@ async def get_users(db: db_dependency, current_user: Users = Depends(get_current
 async def delete_user(user_id:int, db: db_dependency, current_user: Users = Depends(get_current_user)):
     if current_user.user_type != 1: # type: ignore
         raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
-    user = db.query(models.Users).filter(models.Users.id == user_id).first()
-    if not user:
+    popularity.forget_owners(db, [user_id])
+    deleted = db.execute(delete(models.Users).where(models.Users.id == user_id)).rowcount
+    if not deleted:
+        db.rollback()
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(user)
+    version = versions.bump(db, versions.OWNERSHIP)
     db.commit()
+    trades.index.remove_user(user_id)
+    trades.index.applied(version)
     return {"message": "User deleted successfully"}
 
 @app.post("/Ownership", tags=["Ownership"])
@@ -210,12 +377,16 @@ def add_ownership(part_id: int, db: db_dependency, current_user: Users = Depends
         part = part.id
     )
     db.add(ownership)
+    popularity.count_ownership(db, part.id, 1)
+    version = versions.bump(db, versions.OWNERSHIP)
     db.commit()
     db.refresh(ownership)
+    trades.index.set_copies(current_user.id, part.id, trades.copies(db, current_user.id, part.id), version)
+    events.ownership_changed(current_user.id, "add", part.id)
     return {"message": "Ownership added successfully", "ownership": ownership}
 
 @app.get("/Ownership", response_model=List[Part_Out], tags=["Ownership"])
-def get_ownership(db: db_dependency, current_user: Users = Depends(get_current_user)):
+def get_ownership(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
     if not current_user:
         raise HTTPException(status_code=404, detail="Aw hell naw spunch bop")
     result = db.query(models.Ownerships).filter(models.Ownerships.owner == current_user.id).all()
@@ -223,6 +394,13 @@ def get_ownership(db: db_dependency, current_user: Users = Depends(get_current_u
         raise HTTPException(status_code=404, detail="No ownership found")
     return result
 
+@app.get("/Ownership/trades", response_model=List[Trade_Out], tags=["Ownership"])
+def get_trades(db: read_db_dependency, limit: int = 10, current_user: Users = Depends(get_read_user)):
+    trades.index.refresh(db)
+    matches = trades.index.partners(current_user.id, min(limit, 100))
+    usernames = dict(db.query(models.Users.id, models.Users.username).filter(models.Users.id.in_([match["user"] for match in matches])).all()) if matches else {}
+    return [{**match, "username": usernames.get(match["user"], "")} for match in matches]
+
 @app.delete("/Ownership/{part_id}", tags=["Ownership"])
 def delete_ownership(part_id: int, db: db_dependency, current_user: Users = Depends(get_current_user)):
     if not current_user:
@@ -230,22 +408,51 @@ def delete_ownership(part_id: int, db: db_dependency, current_user: Users = Depe
     ownership = db.query(models.Ownerships).filter(models.Ownerships.part == part_id, models.Ownerships.owner == current_user.id).first()
     if not ownership:
         raise HTTPException(status_code=404, detail="Ownership not found")
+    popularity.count_ownership(db, ownership.part, -1)
     db.delete(ownership)
+    version = versions.bump(db, versions.OWNERSHIP)
     db.commit()
+    trades.index.set_copies(current_user.id, part_id, trades.copies(db, current_user.id, part_id), version)
+    events.ownership_changed(current_user.id, "delete", part_id)
     return {"message": "Ownership deleted successfully"}
 
 @app.post("/Combos", tags=["Combos"])
 def add_combo(combo: Combo_In, db: db_dependency, current_user: Users = Depends(get_current_user)):
+    slots = [part_id for part_id in (combo.lockChip, combo.blade, combo.assBlade, combo.ratchet, combo.bit) if part_id is not None]
+    compatibility.index.refresh(db)
+    unknown, conflicts = compatibility.index.check(slots)
+    if unknown:
+        # Parts created through another worker aren't in this worker's index yet
+        for part_id, type_id, restriction_id in db.query(models.Parts.id, models.Parts.type, models.Parts.restriction).filter(models.Parts.id.in_(unknown)):
+            compatibility.index.set_part(part_id, type_id, restriction_id)
+        unknown, conflicts = compatibility.index.check(slots)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Parts with IDs {unknown} not found")
+    if conflicts:
+        raise HTTPException(status_code=400, detail=f"Restricted parts can't be combined: {conflicts}")
     new_combo = models.Combos(
-        name=combo.description
+        isStock=combo.isStock,
+        line=combo.line,
+        lock_chip=combo.lockChip,
+        main_blade=combo.blade,
+        assis_blade=combo.assBlade,
+        ratchet=combo.ratchet,
+        bit=combo.bit,
+        description=combo.description
     )
-    db.add(new_combo)
-    db.commit()
+    try:
+        db.add(new_combo)
+        popularity.count_combo(db, new_combo, 1)
+        db.commit()
+    except IntegrityError:
+        # A part or line removed since this worker's index last refreshed
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Part or line not found")
     db.refresh(new_combo)
-    return {"message": "Combo added successfully", "combo": new_combo.name}
+    return {"message": "Combo added successfully", "combo": new_combo.id}
 
 @app.get("/Combos", response_model=List[Combo_Out], tags=["Combos"])
-def get_combos(db: db_dependency, type: str, current_user: Users = Depends(get_current_user)):
+def get_combos(db: read_db_dependency, type: str, current_user: Users = Depends(get_read_user)):
     query = db.query(models.Combos)
     if type:
         query = query.filter(models.Combos.type == type)
@@ -263,6 +470,7 @@ def delete_combo(combo_id: int, db: db_dependency, current_user: Users = Depends
     combo = db.query(models.Combos).filter(models.Combos.id == combo_id).first()
     if not combo:
         raise HTTPException(status_code=404, detail="Combo not found")
+    popularity.count_combo(db, combo, -1)
     db.delete(combo)
     db.commit()
     return {"message": "Combo deleted successfully"}
@@ -275,13 +483,17 @@ def add_type(type: PartType_In, db: db_dependency, current_user: Users = Depends
         name=type.name
     )
     db.add(new_type)
+    version = versions.bump(db, versions.CATALOG)
     db.commit()
     db.refresh(new_type)
+    catalog_applied(version)
+    publish_catalog("type", "add", id=new_type.id)
     return {"message": "Type added successfully", "type": new_type.name}
 
 @app.get("/Types", response_model=List[PartType_Out], tags=["Types"])
-def get_types(db: db_dependency, current_user: Users = Depends(get_current_user)):
-    result = db.query(models.PartTypes).all()
+def get_types(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
+    catalog = snapshot.current(db)
+    result = catalog.types() if catalog else db.query(models.PartTypes).all()
     if not result:
         raise HTTPException(status_code=404, detail="No types found")
     return result
@@ -293,8 +505,16 @@ def delete_type(type_id: int, db: db_dependency, current_user: Users = Depends(g
     type = db.query(models.PartTypes).filter(models.PartTypes.id == type_id).first()
     if not type:
         raise HTTPException(status_code=404, detail="Type not found")
-    db.delete(type)
-    db.commit()
+    try:
+        db.delete(type)
+        version = versions.bump(db, versions.CATALOG)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Type still has parts")
+    lookups.forget_type(type_id)
+    catalog_applied(version)
+    publish_catalog("type", "delete", id=type_id)
     return {"message": "Type deleted successfully"}
 
 @app.post("/Restrictions", tags=["Restrictions"])
@@ -305,13 +525,17 @@ def add_restriction(restriction: Restriction_Create, db: db_dependency, current_
         description=restriction.description
     )
     db.add(new_restriction)
+    version = versions.bump(db, versions.CATALOG)
     db.commit()
     db.refresh(new_restriction)
+    catalog_applied(version)
+    publish_catalog("restriction", "add", id=new_restriction.id)
     return {"message": "Restriction added successfully", "restriction": new_restriction.description}
 
 @app.get("/Restrictions", response_model=List[Restriction_Out], tags=["Restrictions"])
-def get_restrictions(db: db_dependency, current_user: Users = Depends(get_current_user)):
-    result = db.query(models.Restrictions).all()
+def get_restrictions(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
+    catalog = snapshot.current(db)
+    result = catalog.restrictions() if catalog else db.query(models.Restrictions).all()
     if not result:
         raise HTTPException(status_code=404, detail="No restrictions found")
     return result
@@ -324,9 +548,46 @@ def delete_restriction(restriction_id: int, db: db_dependency, current_user: Use
     if not restriction:
         raise HTTPException(status_code=404, detail="Restriction not found")
     db.delete(restriction)
+    version = versions.bump(db, versions.CATALOG)
     db.commit()
+    lookups.forget_restriction(restriction_id)
+    compatibility.index.remove_restriction(restriction_id)
+    catalog_applied(version)
+    publish_catalog("restriction", "delete", id=restriction_id)
     return {"message": "Restriction deleted successfully"}
 
+@app.post("/Restrictions/{restriction_id}/Parts/{part_id}", tags=["Restrictions"])
+def add_restriction_part(restriction_id: int, part_id: int, db: db_dependency, current_user: Users = Depends(get_current_user)):
+    if current_user.user_type != 1: # type: ignore
+        raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
+    if not lookups.restriction_exists(db, restriction_id):
+        raise HTTPException(status_code=404, detail="Restriction not found")
+    if not db.query(models.Parts.id).filter(models.Parts.id == part_id).first():
+        raise HTTPException(status_code=404, detail="Part not found")
+    if db.query(models.RestrictionParts).filter(models.RestrictionParts.restriction == restriction_id, models.RestrictionParts.part == part_id).first():
+        raise HTTPException(status_code=400, detail="Part already restricted")
+    db.add(models.RestrictionParts(restriction=restriction_id, part=part_id))
+    version = versions.bump(db, versions.CATALOG)
+    db.commit()
+    compatibility.index.add_rule(restriction_id, part_id)
+    catalog_applied(version)
+    publish_catalog("restriction", "update", id=restriction_id)
+    return {"message": "Restricted part added successfully"}
+
+@app.delete("/Restrictions/{restriction_id}/Parts/{part_id}", tags=["Restrictions"])
+def delete_restriction_part(restriction_id: int, part_id: int, db: db_dependency, current_user: Users = Depends(get_current_user)):
+    if current_user.user_type != 1: # type: ignore
+        raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
+    deleted = db.execute(delete(models.RestrictionParts).where(models.RestrictionParts.restriction == restriction_id, models.RestrictionParts.part == part_id)).rowcount
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Restricted part not found")
+    version = versions.bump(db, versions.CATALOG)
+    db.commit()
+    compatibility.index.remove_rule(restriction_id, part_id)
+    catalog_applied(version)
+    publish_catalog("restriction", "update", id=restriction_id)
+    return {"message": "Restricted part deleted successfully"}
+
 @app.post("/Lines", tags=["Lines"])
 def add_line(line: Line_In, db: db_dependency, current_user: Users = Depends(get_current_user)):
     if current_user.user_type != 1: # type: ignore
@@ -335,13 +596,17 @@ def add_line(line: Line_In, db: db_dependency, current_user: Users = Depends(get
         name=line.name
     )
     db.add(new_line)
+    version = versions.bump(db, versions.CATALOG)
     db.commit()
     db.refresh(new_line)
+    catalog_applied(version)
+    publish_catalog("line", "add", id=new_line.id)
     return {"message": "Line added successfully", "line": new_line.name}
 
 @app.get("/Lines", response_model=List[Line_Out], tags=["Lines"])
-def get_lines(db: db_dependency, current_user: Users = Depends(get_current_user)):
-    result = db.query(models.Lines).all()
+def get_lines(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
+    catalog = snapshot.current(db)
+    result = catalog.lines() if catalog else db.query(models.Lines).all()
     if not result:
         raise HTTPException(status_code=404, detail="No lines found")
     return result
@@ -353,67 +618,106 @@ def delete_line(line_id: int, db: db_dependency, current_user: Users = Depends(g
     line = db.query(models.Lines).filter(models.Lines.id == line_id).first()
     if not line:
         raise HTTPException(status_code=404, detail="Line not found")
-    db.delete(line)
-    db.commit()
+    try:
+        db.delete(line)
+        version = versions.bump(db, versions.CATALOG)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Line still has combos")
+    catalog_applied(version)
+    publish_catalog("line", "delete", id=line_id)
     return {"message": "Line deleted successfully"}
 #--------------------------------------------------------------------------------------------------------------------------
 @app.post("/Parts", tags=["Parts"])
-def add_part(part: Part_In, db: db_dependency, current_user: Users = Depends(get_current_user)):
+def add_part(part: Part_In, db: db_dependency, current_user: Users = Depends(get_current_user), idempotency_key: Optional[str] = Header(default=None)):
     if current_user.user_type != 1: # type: ignore
         raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
-    found_restriction= None
-    
-    if part.restriction:
-        found_restriction = db.query(models.Restrictions).filter(models.Restrictions.id == part.restriction.id).first()
-        if not found_restriction:
+    request_hash = hashlib.sha256(part.model_dump_json().encode()).hexdigest() if idempotency_key else None
+    if idempotency_key:
+        forget_expired_keys(db)
+        replayed = replay_part(db, idempotency_key, current_user, request_hash)
+        if replayed:
+            return replayed
+
+    # Another worker may have removed or recreated a type or restriction we had cached,
+    # so a failed insert resolves them again from the database once
+    for attempt in range(2):
+        if part.restriction and not lookups.restriction_exists(db, part.restriction.id):
             raise HTTPException(status_code=404, detail=f"Restriction with ID {part.restriction.id} not found")
- 
-    found_type = None
-    found_type = db.query(models.PartTypes).filter(models.PartTypes.name == part.type.name).first()
-    if not found_type:
-        raise HTTPException(status_code=404, detail=f"Type with name '{part.type.name}' not found")
-    new_part = models.Parts(
-        name=part.name,
-        type=found_type.id,
-        restriction=found_restriction.id if found_restriction else None
-    )
-    db.add(new_part)
-    db.commit()
-    db.refresh(new_part)
-    created_part = db.query(models.Parts).filter(models.Parts.name == part.name).first()
-    if not created_part:
-        raise HTTPException(status_code=501, detail="Insertion failed, because part was not created")
-    stats = models.Stats(
-        id = created_part.id,
-        minAtk=part.stats.minAtk,
-        maxAtk=part.stats.maxAtk,
-        minDef=part.stats.minDef,
-        maxDef=part.stats.maxDef,
-        minSta=part.stats.minSta,
-        maxSta=part.stats.maxSta,
-        weight=part.stats.weight,
-        burst=part.stats.burst,
-        dash=part.stats.dash
-    )
-    db.add(stats)
-    db.commit()
-    db.refresh(stats)
-    part_stats= db.query(models.Stats).filter(models.Stats.id == created_part.id).first()
-    if not part_stats:
-        raise HTTPException(status_code=501, detail="Insertion failed, because part stats were not created")
-    created_part.stats= part_stats.id
+        type_id = lookups.type_id(db, part.type.name)
+        if not type_id:
+            raise HTTPException(status_code=404, detail=f"Type with name '{part.type.name}' not found")
+
+        new_part = models.Parts(
+            name=part.name,
+            type=type_id,
+            restriction=part.restriction.id if part.restriction else None
+        )
+        try:
+            db.add(new_part)
+            # Part and stats reference each other, so the part id comes back from the insert first
+            db.flush()
+            db.add(models.Stats(id=new_part.id, **part.stats.model_dump()))
+            db.flush()
+            new_part.stats = new_part.id
+            popularity.track_part(db, new_part.id, type_id)
+            if idempotency_key:
+                db.add(models.IdempotencyKeys(key=idempotency_key, owner=current_user.id, part=new_part.id, request_hash=request_hash))
+            db.flush()
+            percentiles.recompute(db, [type_id])
+            version = versions.bump(db, versions.CATALOG)
+            part_id = new_part.id
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            if idempotency_key:
+                replayed = replay_part(db, idempotency_key, current_user, request_hash)
+                if replayed:
+                    return replayed
+            lookups.clear()
+    else:
+        raise HTTPException(status_code=409, detail="Insertion failed, because part type or restriction no longer exists")
+    compatibility.index.set_part(part_id, type_id, part.restriction.id if part.restriction else None)
+    similarity.index.set_part(part_id, type_id, part.name, [getattr(part.stats, column) for column in percentiles.STAT_COLUMNS])
+    catalog_applied(version)
+    publish_catalog("part", "add", id=part_id)
+    return {"message": "Part added successfully", "part": part.name}
+
+def forget_expired_keys(db: Session):
+    cutoff = datetime.now() - timedelta(hours=idempotency_key_hours)
+    db.execute(delete(models.IdempotencyKeys).where(models.IdempotencyKeys.created_date < cutoff))
     db.commit()
 
-    
-    return {"message": "Part added successfully", "part": new_part.name}
+def replay_part(db: Session, idempotency_key: str, current_user: Users, request_hash: str):
+    previous = (
+        db.query(models.IdempotencyKeys.owner, models.IdempotencyKeys.request_hash, models.Parts.name)
+        .outerjoin(models.Parts, models.Parts.id == models.IdempotencyKeys.part)
+        .filter(models.IdempotencyKeys.key == idempotency_key)
+        .first()
+    )
+    if not previous:
+        return None
+    if previous.owner != current_user.id:
+        raise HTTPException(status_code=409, detail="Idempotency key already used")
+    # Keys stored before request hashes were recorded can't be checked
+    if previous.request_hash is not None and previous.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency key already used for a different request")
+    return {"message": "Part added successfully", "part": previous.name}
 
 #--------------------------------------------------------------------------------------------------------------------------
 @app.get("/Parts", response_model=List[Part_Out], tags=["Parts"])
-def get_parts(db: db_dependency, current_user: Users = Depends(get_current_user)):
-    result = db.query(models.Parts).all()
+def get_parts(db: read_db_dependency, current_user: Users = Depends(get_read_user)):
+    catalog = snapshot.current(db)
+    result = catalog.parts() if catalog else db.query(models.Parts).all()
     if not result:
         raise HTTPException(status_code=404, detail="No parts found")
+    if catalog:
+        return result
+    ranked = percentiles.for_parts(db)
     for part in result:
+        part.percentiles = ranked.get(part.id, [])
         stats= db.query(models.Stats).filter(models.Stats.id == part.stats).first()
         restriction=db.query(models.Restrictions).filter(models.Restrictions.id == part.restriction).first()
         if stats:
@@ -424,53 +728,159 @@ def get_parts(db: db_dependency, current_user: Users = Depends(get_current_user)
             part.restriction = restriction
     return result
 
-@app.patch("/Parts/{part_id}", tags=["Parts"])
-def update_part(part_id: int, part: Part_In, db: db_dependency, current_user: Users = Depends(get_current_user)):
+@app.get("/Parts/popular", response_model=List[Popularity_Out], tags=["Parts"])
+def get_popular_parts(type_id: int, db: read_db_dependency, by: str = "owned", limit: int = 10, current_user: Users = Depends(get_read_user)):
+    if by not in ("owned", "combos"):
+        raise HTTPException(status_code=400, detail="Leaderboard must be 'owned' or 'combos'")
+    return popularity.top_parts(db, type_id, by, min(limit, 100))
+
+@app.post("/Parts/popular/rebuild", tags=["Parts"])
+def rebuild_popularity(db: db_dependency, current_user: Users = Depends(get_current_user)):
     if current_user.user_type != 1: # type: ignore
         raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
-    
-    existing_part = db.query(models.Parts).filter(models.Parts.id == part_id).first() if part_id else None
-    if not existing_part:
+    popularity.rebuild(db)
+    return {"message": "Popularity counters rebuilt successfully"}
+
+@app.get("/Parts/{part_id}/compatible", tags=["Parts"])
+def get_compatible_parts(part_id: int, db: db_dependency, type_id: Optional[int] = None, current_user: Users = Depends(get_current_user)):
+    # Answered from this worker's index, the session only checks the catalog version for a
+    # reload. That check stays on the primary so it sees other workers' writes right away.
+    compatibility.index.refresh(db)
+    if part_id not in compatibility.index.part_type:
         raise HTTPException(status_code=404, detail="Part not found")
-    
-    type = db.query(models.PartTypes).filter(models.PartTypes.name == part.type.name).first()
-    if not type:
-        raise HTTPException(status_code=404, detail=f"Type with name '{part.type.name}' not found")
+    return compatibility.index.compatible(part_id, type_id)
 
-    existing_stats = db.query(models.Stats).filter(models.Stats.id == existing_part.stats).first()
-    if not existing_stats:
-        raise HTTPException(status_code=404, detail="Stats not found for the part")
-    restriction = db.query(models.Restrictions).filter(models.Restrictions.id == part.restriction.id).first() if part.restriction else None
-    
-    existing_stats.minAtk = part.stats.minAtk # type: ignore
-    existing_stats.maxAtk = part.stats.maxAtk # type: ignore
-    existing_stats.minDef = part.stats.minDef # type: ignore
-    existing_stats.maxDef = part.stats.maxDef # type: ignore
-    existing_stats.minSta = part.stats.minSta # type: ignore
-    existing_stats.maxSta = part.stats.maxSta # type: ignore
-    existing_stats.weight = part.stats.weight # type: ignore
-    existing_stats.burst = part.stats.burst # type: ignore
-    existing_stats.dash = part.stats.dash # type: ignore
-
-    existing_part.name = part.name # type: ignore
-    existing_part.type = type.id
-    existing_part.restriction = restriction.id if restriction else None # type: ignore
+@app.post("/Parts/percentiles/rebuild", tags=["Parts"])
+def rebuild_percentiles(db: db_dependency, current_user: Users = Depends(get_current_user)):
+    if current_user.user_type != 1: # type: ignore
+        raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
+    percentiles.recompute(db)
+    version = versions.bump(db, versions.CATALOG)
     db.commit()
-    db.refresh(existing_part)
-    return {"message": "Part updated successfully", "part": existing_part.name}
+    catalog_applied(version)
+    snapshot.publish()
+    return {"message": "Stat percentiles rebuilt successfully"}
+
+@app.get("/Parts/{part_id}/similar", response_model=List[Similar_Out], tags=["Parts"])
+def get_similar_parts(part_id: int, db: db_dependency, k: int = 5, current_user: Users = Depends(get_current_user)):
+    # On the primary like get_compatible_parts, parts another worker just created are
+    # loaded from it on a miss and wouldn't be on a lagging replica yet
+    similarity.index.refresh(db)
+    result = similarity.index.similar(part_id, min(k, 50))
+    if result is None and similarity.index.load_type(db, part_id):
+        # Created through another worker since the last refresh
+        result = similarity.index.similar(part_id, min(k, 50))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Part not found")
+    return result
+
+@app.patch("/Parts/{part_id}", tags=["Parts"])
+def update_part(part_id: int, part: Part_In, db: db_dependency, current_user: Users = Depends(get_current_user)):
+    if current_user.user_type != 1: # type: ignore
+        raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
+
+    # Cached types and restrictions are resolved again once if the update hits a stale one
+    for attempt in range(2):
+        type_id = lookups.type_id(db, part.type.name)
+        if not type_id:
+            raise HTTPException(status_code=404, detail=f"Type with name '{part.type.name}' not found")
+        if part.restriction and not lookups.restriction_exists(db, part.restriction.id):
+            raise HTTPException(status_code=404, detail=f"Restriction with ID {part.restriction.id} not found")
+
+        existing_part = db.query(models.Parts.type).filter(models.Parts.id == part_id).first()
+        if not existing_part:
+            raise HTTPException(status_code=404, detail="Part not found")
+        try:
+            # The UPDATEs go out immediately, so foreign key errors can surface from any of them
+            db.query(models.Parts).filter(models.Parts.id == part_id).update({
+                models.Parts.name: part.name,
+                models.Parts.type: type_id,
+                models.Parts.restriction: part.restriction.id if part.restriction else None
+            }, synchronize_session=False)
+            stats_id = select(models.Parts.stats).where(models.Parts.id == part_id).scalar_subquery()
+            updated = db.query(models.Stats).filter(models.Stats.id == stats_id).update(
+                part.stats.model_dump(), synchronize_session=False
+            )
+            if not updated:
+                db.rollback()
+                raise HTTPException(status_code=404, detail="Stats not found for the part")
+            popularity.retype_part(db, part_id, type_id)
+            # Ranks only shift within the part's old and new type
+            percentiles.recompute(db, {existing_part.type, type_id})
+            version = versions.bump(db, versions.CATALOG)
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            lookups.clear()
+    else:
+        raise HTTPException(status_code=409, detail="Update failed, because part type or restriction no longer exists")
+    compatibility.index.set_part(part_id, type_id, part.restriction.id if part.restriction else None)
+    similarity.index.set_part(part_id, type_id, part.name, [getattr(part.stats, column) for column in percentiles.STAT_COLUMNS])
+    catalog_applied(version)
+    publish_catalog("part", "update", id=part_id)
+    return {"message": "Part updated successfully", "part": part.name}
 
 @app.delete("/Parts/{part_id}", tags=["Parts"])
 def delete_part(part_id: int, db: db_dependency, current_user: Users = Depends(get_current_user)):
     if current_user.user_type != 1: # type: ignore
         raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
-
-    existing_part = db.query(models.Parts).filter(models.Parts.id == part_id).first()
-    if not existing_part:
+    # Stats, ownerships and counters cascade, combo slots are set to NULL
+    deleted = db.execute(delete(models.Parts).where(models.Parts.id == part_id).returning(models.Parts.type)).first()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Part not found")
-    existing_stats = db.query(models.Stats).filter(models.Stats.id == existing_part.stats).first()
-    if not existing_stats:
-        raise HTTPException(status_code=404, detail="Stats not found for the part")
-    db.delete(existing_part)
-    db.delete(existing_stats)
+    percentiles.recompute(db, [deleted.type])
+    version = versions.bump(db, versions.CATALOG)
+    # Ownerships of the part cascaded away with it
+    ownership_version = versions.bump(db, versions.OWNERSHIP)
+    db.commit()
+    compatibility.index.remove_part(part_id)
+    similarity.index.remove_part(part_id)
+    trades.index.remove_parts([part_id])
+    trades.index.applied(ownership_version)
+    catalog_applied(version)
+    publish_catalog("part", "delete", id=part_id)
+    return {"message": "Part deleted successfully"}
+
+@app.delete("/Parts", tags=["Parts"])
+def delete_parts(parts: Part_Bulk_Delete, db: db_dependency, current_user: Users = Depends(get_current_user)):
+    if current_user.user_type != 1: # type: ignore
+        raise HTTPException(status_code=403, detail="Operation forbidden: Admins only")
+    if parts.ids and (parts.type is not None or parts.line is not None):
+        raise HTTPException(status_code=400, detail="Delete by part IDs or by type/line, not both")
+    conditions = []
+    if parts.ids:
+        conditions.append(models.Parts.id.in_(parts.ids))
+    if parts.type is not None:
+        conditions.append(models.Parts.type == parts.type)
+    if parts.line is not None:
+        # Parts have no line of their own, a line's parts are the ones in its stock combos.
+        # Parts that another line's stock combos also use are kept.
+        def stock_parts(line_filter):
+            slots = union(*[
+                select(getattr(models.Combos, slot).label("part")).where(models.Combos.isStock == True, line_filter)
+                for slot in popularity.COMBO_SLOTS
+            ]).subquery()
+            # NOT IN against a NULL would match nothing, empty slots are dropped here
+            return select(slots.c.part).where(slots.c.part.isnot(None))
+        conditions.append(models.Parts.id.in_(stock_parts(models.Combos.line == parts.line)))
+        conditions.append(models.Parts.id.not_in(stock_parts(or_(models.Combos.line != parts.line, models.Combos.line.is_(None)))))
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Give part IDs, or a type and/or line to delete")
+    deleted = db.execute(delete(models.Parts).where(*conditions).returning(models.Parts.id, models.Parts.type)).all()
+    version = ownership_version = None
+    if deleted:
+        percentiles.recompute(db, {row.type for row in deleted})
+        version = versions.bump(db, versions.CATALOG)
+        ownership_version = versions.bump(db, versions.OWNERSHIP)
     db.commit()
-    return {"message": "Part deleted successfully"}
\ No newline at end of file
+    deleted = [row.id for row in deleted]
+    for part_id in deleted:
+        compatibility.index.remove_part(part_id)
+        similarity.index.remove_part(part_id)
+    if deleted:
+        trades.index.remove_parts(deleted)
+        trades.index.applied(ownership_version)
+        catalog_applied(version)
+        publish_catalog("part", "delete", ids=deleted)
+    return {"message": "Parts deleted successfully", "deleted": len(deleted)}
\ No newline at end of file
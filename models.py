@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Index
 from database import Base
 from datetime import datetime
 
@@ -19,22 +19,22 @@ class Users(Base):
 class Ownerships(Base):
 	__tablename__ = 'ownerships'
 	id = Column(Integer, primary_key=True, index=True)
-	owner = Column(Integer, ForeignKey('users.id'))
-	part = Column(Integer, ForeignKey('parts.id'))
+	owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+	part = Column(Integer, ForeignKey('parts.id', ondelete='CASCADE'))
 
 class Parts(Base):
 	__tablename__ = 'parts'
 	id = Column(Integer, primary_key=True, index=True)
 	name = Column(String, index=True)
-	stats = Column(Integer, ForeignKey('stats.id'), nullable=True)
+	stats = Column(Integer, ForeignKey('stats.id', ondelete='SET NULL'), nullable=True)
 	color = Column(String, index=True)
 	type = Column(Integer, ForeignKey('part_types.id'))
-	restriction = Column(Integer, ForeignKey('restrictions.id'), nullable=True, default=None)
+	restriction = Column(Integer, ForeignKey('restrictions.id', ondelete='SET NULL'), nullable=True, default=None)
 	description = Column(String, nullable=True, default=None)
 
 class Stats(Base):
 	__tablename__ = 'stats'
-	id = Column(ForeignKey('parts.id'), primary_key=True, index=True)
+	id = Column(ForeignKey('parts.id', ondelete='CASCADE'), primary_key=True, index=True)
 	minAtk = Column(Integer, nullable=True, default=None)
 	maxAtk = Column(Integer, nullable=True, default=None)
 	minDef = Column(Integer, nullable=True, default=None)
@@ -50,15 +50,34 @@ class Combos(Base):
 	id = Column(Integer, primary_key=True, index=True)
 	isStock = Column(Boolean, default=False)
 	line = Column(Integer, ForeignKey('lines.id'))
-	lock_chip = Column(Integer, ForeignKey('parts.id'), nullable=True, default=None)
-	main_blade = Column(Integer, ForeignKey('parts.id'), nullable=True, default=None)
-	assis_blade = Column(Integer, ForeignKey('parts.id'), nullable=True, default=None)
-	ratchet = Column(Integer, ForeignKey('parts.id'), nullable=True, default=None)
-	bit = Column(Integer, ForeignKey('parts.id'), nullable=True, default=None)
+	lock_chip = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True, default=None)
+	main_blade = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True, default=None)
+	assis_blade = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True, default=None)
+	ratchet = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True, default=None)
+	bit = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True, default=None)
 	combo_type = Column(String, nullable=True, default=None)
 	description = Column(String)
 	created_date = Column(DateTime, default=datetime.now)
 
+class PartPopularity(Base):
+	__tablename__ = 'part_popularity'
+	part = Column(Integer, ForeignKey('parts.id', ondelete='CASCADE'), primary_key=True, index=True)
+	part_type = Column(Integer, ForeignKey('part_types.id'), nullable=True)
+	owned_count = Column(Integer, default=0, nullable=False)
+	combo_count = Column(Integer, default=0, nullable=False)
+	__table_args__ = (
+		Index('ix_part_popularity_type_owned', 'part_type', 'owned_count'),
+		Index('ix_part_popularity_type_combo', 'part_type', 'combo_count'),
+	)
+
+class IdempotencyKeys(Base):
+	__tablename__ = 'idempotency_keys'
+	key = Column(String, primary_key=True, index=True)
+	owner = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
+	part = Column(Integer, ForeignKey('parts.id', ondelete='SET NULL'), nullable=True)
+	request_hash = Column(String, nullable=True)
+	created_date = Column(DateTime, default=datetime.now, index=True)
+
 class Lines(Base):
     __tablename__ = 'lines'
     id = Column(Integer, primary_key=True, index=True)
@@ -72,4 +91,29 @@ class PartTypes(Base):
 class Restrictions(Base):
     __tablename__ = 'restrictions'
     id = Column(Integer, primary_key=True, index=True)
-    description = Column(String, unique=True, index=True)
\ No newline at end of file
+    description = Column(String, unique=True, index=True)
+
+class RestrictionParts(Base):
+	__tablename__ = 'restriction_parts'
+	restriction = Column(Integer, ForeignKey('restrictions.id', ondelete='CASCADE'), primary_key=True)
+	part = Column(Integer, ForeignKey('parts.id', ondelete='CASCADE'), primary_key=True)
+
+class StatPercentiles(Base):
+	__tablename__ = 'stat_percentiles'
+	part = Column(Integer, ForeignKey('parts.id', ondelete='CASCADE'), primary_key=True)
+	stat = Column(String, primary_key=True)
+	percentile = Column(Integer, nullable=False)
+	tier = Column(String, nullable=False)
+
+class Events(Base):
+	__tablename__ = 'events'
+	id = Column(Integer, primary_key=True)
+	origin = Column(String, nullable=False)
+	user_id = Column(Integer, nullable=True)
+	payload = Column(String, nullable=False)
+	created_date = Column(DateTime, default=datetime.now, index=True)
+
+class IndexVersions(Base):
+	__tablename__ = 'index_versions'
+	name = Column(String, primary_key=True)
+	version = Column(Integer, default=0, nullable=False)
\ No newline at end of file
@@ -0,0 +1,82 @@
+import bisect
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+import models
+
+STAT_COLUMNS = ("minAtk", "maxAtk", "minDef", "maxDef", "minSta", "maxSta", "weight", "burst", "dash")
+# Lowest percentile of each tier, a part below 15 is tier D
+TIER_FLOORS = np.array([15, 40, 70, 90])
+TIER_NAMES = np.array(["D", "C", "B", "A", "S"])
+
+def rank(values: np.ndarray) -> np.ndarray:
+    """Percentile rank (0-100) of every value within its column, NaN where the stat is missing."""
+    present = ~np.isnan(values)
+    counts = present.sum(axis=0)
+    ordered = np.sort(values, axis=0)
+    ranks = np.full(values.shape, np.nan)
+    for column in range(values.shape[1]):
+        if not counts[column]:
+            continue
+        valid = ordered[:counts[column], column]
+        below = np.searchsorted(valid, values[:, column], side="left")
+        upto = np.searchsorted(valid, values[:, column], side="right")
+        # Ties share the midpoint of their range
+        ranks[:, column] = (below + upto) * 50.0 / counts[column]
+    ranks[~present] = np.nan
+    return ranks
+
+def tier(percentile: int) -> str:
+    return str(TIER_NAMES[bisect.bisect_right(TIER_FLOORS.tolist(), percentile)])
+
+def recompute(db: Session, type_ids=None):
+    """Rebuilds stat_percentiles for the given part types, or for every type. The caller commits."""
+    query = db.query(models.Parts.id, models.Parts.type, *[getattr(models.Stats, column) for column in STAT_COLUMNS]).join(models.Stats, models.Stats.id == models.Parts.stats)
+    if type_ids is not None:
+        query = query.filter(models.Parts.type.in_(type_ids))
+    rows = query.all()
+
+    stale = delete(models.StatPercentiles)
+    if type_ids is not None:
+        stale = stale.where(models.StatPercentiles.part.in_(db.query(models.Parts.id).filter(models.Parts.type.in_(type_ids))))
+    db.execute(stale)
+    if not rows:
+        return
+
+    part_ids = np.array([row[0] for row in rows])
+    part_types = np.array([row[1] if row[1] is not None else -1 for row in rows])
+    values = np.array([row[2:] for row in rows], dtype=float)
+    ranks = np.full(values.shape, np.nan)
+    for part_type in np.unique(part_types):
+        group = part_types == part_type
+        ranks[group] = rank(values[group])
+    tiers = TIER_NAMES[np.searchsorted(TIER_FLOORS, np.nan_to_num(ranks), side="right")]
+
+    part_index, stat_index = np.nonzero(~np.isnan(ranks))
+    db.execute(insert(models.StatPercentiles), [
+        {
+            "part": int(part_ids[i]),
+            "stat": STAT_COLUMNS[j],
+            "percentile": int(ranks[i, j]),
+            "tier": str(tiers[i, j]),
+        }
+        for i, j in zip(part_index, stat_index)
+    ])
+
+def for_parts(db: Session, part_ids=None):
+    query = db.query(models.StatPercentiles)
+    if part_ids is not None:
+        query = query.filter(models.StatPercentiles.part.in_(part_ids))
+    grouped = {}
+    for row in query:
+        grouped.setdefault(row.part, []).append(row)
+    return grouped
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        recompute(db)
+        db.commit()
+    finally:
+        db.close()
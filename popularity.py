@@ -0,0 +1,112 @@
+from sqlalchemy import select, update, delete, insert, union, func
+from sqlalchemy.orm import Session
+import models
+
+# Part columns of a combo, a part used in several slots of one combo counts once
+COMBO_SLOTS = ("lock_chip", "main_blade", "assis_blade", "ratchet", "bit")
+
+def combo_parts(combo: models.Combos) -> set:
+    return {getattr(combo, slot) for slot in COMBO_SLOTS if getattr(combo, slot) is not None}
+
+def _bump(db: Session, part_ids, column: str, delta: int):
+    part_ids = set(part_ids)
+    if not part_ids:
+        return
+    counter = getattr(models.PartPopularity, column)
+    result = db.execute(
+        update(models.PartPopularity)
+        .where(models.PartPopularity.part.in_(part_ids))
+        .values({column: counter + delta})
+    )
+    if result.rowcount == len(part_ids) or delta < 0:
+        return
+    # Parts created before the counters existed get their row on first use
+    existing = {row.part for row in db.query(models.PartPopularity.part).filter(models.PartPopularity.part.in_(part_ids))}
+    for part_id, part_type in db.query(models.Parts.id, models.Parts.type).filter(models.Parts.id.in_(part_ids - existing)):
+        db.add(models.PartPopularity(part=part_id, part_type=part_type, **{column: delta}))
+
+def track_part(db: Session, part_id: int, part_type: int):
+    db.add(models.PartPopularity(part=part_id, part_type=part_type, owned_count=0, combo_count=0))
+
+def retype_part(db: Session, part_id: int, part_type: int):
+    db.execute(
+        update(models.PartPopularity)
+        .where(models.PartPopularity.part == part_id)
+        .values(part_type=part_type)
+    )
+
+def count_ownership(db: Session, part_id: int, delta: int):
+    _bump(db, [part_id], "owned_count", delta)
+
+def count_combo(db: Session, combo: models.Combos, delta: int):
+    _bump(db, combo_parts(combo), "combo_count", delta)
+
+def forget_owners(db: Session, user_ids):
+    # Ownerships of deleted users go away through ON DELETE CASCADE, take them off the counters first
+    owned = (
+        select(func.count())
+        .where(models.Ownerships.part == models.PartPopularity.part, models.Ownerships.owner.in_(user_ids))
+        .scalar_subquery()
+    )
+    db.execute(
+        update(models.PartPopularity)
+        .where(models.PartPopularity.part.in_(select(models.Ownerships.part).where(models.Ownerships.owner.in_(user_ids))))
+        .values(owned_count=models.PartPopularity.owned_count - owned)
+    )
+
+def top_parts(db: Session, part_type: int, by: str = "owned", limit: int = 10):
+    counter = models.PartPopularity.owned_count if by == "owned" else models.PartPopularity.combo_count
+    rows = (
+        db.query(models.PartPopularity.part, models.Parts.name, counter)
+        .join(models.Parts, models.Parts.id == models.PartPopularity.part)
+        .filter(models.PartPopularity.part_type == part_type)
+        .order_by(counter.desc(), models.PartPopularity.part)
+        .limit(limit)
+        .all()
+    )
+    return [{"part": part, "name": name, "count": count} for part, name, count in rows]
+
+def rebuild(db: Session):
+    owned = (
+        select(models.Ownerships.part.label("part"), func.count().label("n"))
+        .where(models.Ownerships.part.isnot(None))
+        .group_by(models.Ownerships.part)
+        .subquery()
+    )
+    # UNION (not UNION ALL) collapses a part repeated across slots of the same combo
+    slots = union(*[
+        select(models.Combos.id.label("combo"), getattr(models.Combos, slot).label("part"))
+        for slot in COMBO_SLOTS
+    ]).subquery()
+    used = (
+        select(slots.c.part, func.count().label("n"))
+        .where(slots.c.part.isnot(None))
+        .group_by(slots.c.part)
+        .subquery()
+    )
+    rows = (
+        select(
+            models.Parts.id,
+            models.Parts.type,
+            func.coalesce(owned.c.n, 0),
+            func.coalesce(used.c.n, 0),
+        )
+        .select_from(models.Parts)
+        .outerjoin(owned, owned.c.part == models.Parts.id)
+        .outerjoin(used, used.c.part == models.Parts.id)
+    )
+    db.execute(delete(models.PartPopularity))
+    db.execute(
+        insert(models.PartPopularity).from_select(
+            ["part", "part_type", "owned_count", "combo_count"], rows
+        )
+    )
+    db.commit()
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        rebuild(db)
+    finally:
+        db.close()
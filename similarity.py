@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+from sqlalchemy.orm import Session
+import models
+import versions
+from percentiles import STAT_COLUMNS
+
+class TypeVectors:
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, len(STAT_COLUMNS)))
+        self.normalized = None
+
+    def normalize(self):
+        # Min-max scaled within the type so every stat weighs the same, missing stats sit mid-range
+        if self.normalized is None:
+            with np.errstate(all="ignore"):
+                low = np.nanmin(self.values, axis=0)
+                span = np.nanmax(self.values, axis=0) - low
+            span[~(span > 0)] = 1.0
+            self.normalized = np.nan_to_num((self.values - low) / span, nan=0.5)
+        return self.normalized
+
+def _load_rows(db: Session, *filters):
+    rows = (
+        db.query(models.Parts.id, models.Parts.type, models.Parts.name, *[getattr(models.Stats, column) for column in STAT_COLUMNS])
+        .join(models.Stats, models.Stats.id == models.Parts.stats)
+        .filter(*filters)
+        .all()
+    )
+    types = {}
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[1], []).append(row)
+    for type_id, group in grouped.items():
+        vectors = TypeVectors()
+        vectors.ids = np.array([row[0] for row in group], dtype=np.int64)
+        vectors.values = np.array([row[3:] for row in group], dtype=float)
+        types[type_id] = vectors
+    return rows, types
+
+class SimilarityIndex(versions.VersionedIndex):
+    version_name = versions.CATALOG
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.types = {}
+        self.part_type = {}
+        self.names = {}
+
+    def load(self, db: Session):
+        # Read the version first, a write landing mid-load just triggers another reload
+        version = versions.read(db, self.version_name)
+        rows, types = _load_rows(db)
+        with self.lock:
+            self.types = types
+            self.part_type = {row[0]: row[1] for row in rows}
+            self.names = {row[0]: row[2] for row in rows}
+            self.version = version
+
+    def load_type(self, db: Session, part_id: int) -> bool:
+        """Reloads the type of a part this worker doesn't know, returns whether the part exists."""
+        type_id = db.query(models.Parts.type).filter(models.Parts.id == part_id).scalar()
+        if type_id is None:
+            return False
+        rows, types = _load_rows(db, models.Parts.type == type_id)
+        with self.lock:
+            for stale in [known for known, known_type in self.part_type.items() if known_type == type_id]:
+                del self.part_type[stale]
+                self.names.pop(stale, None)
+            self.types[type_id] = types.get(type_id, TypeVectors())
+            self.part_type.update({row[0]: row[1] for row in rows})
+            self.names.update({row[0]: row[2] for row in rows})
+        return part_id in self.part_type
+
+    def _drop(self, part_id):
+        type_id = self.part_type.pop(part_id, None)
+        vectors = self.types.get(type_id)
+        if vectors is not None:
+            keep = vectors.ids != part_id
+            vectors.ids = vectors.ids[keep]
+            vectors.values = vectors.values[keep]
+            vectors.normalized = None
+
+    def set_part(self, part_id: int, type_id: int, name: str, stats):
+        with self.lock:
+            self._drop(part_id)
+            vectors = self.types.setdefault(type_id, TypeVectors())
+            vectors.ids = np.append(vectors.ids, part_id)
+            vectors.values = np.vstack([vectors.values, np.array(stats, dtype=float)])
+            vectors.normalized = None
+            self.part_type[part_id] = type_id
+            self.names[part_id] = name
+
+    def remove_part(self, part_id: int):
+        with self.lock:
+            self._drop(part_id)
+            self.names.pop(part_id, None)
+
+    def similar(self, part_id: int, k: int):
+        with self.lock:
+            vectors = self.types.get(self.part_type.get(part_id))
+            if vectors is None:
+                return None
+            ids = vectors.ids
+            normalized = vectors.normalize()
+        row = np.flatnonzero(ids == part_id)[0]
+        distances = np.sqrt(((normalized - normalized[row]) ** 2).sum(axis=1))
+        distances[row] = np.inf
+        k = min(k, len(ids) - 1)
+        if k <= 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [
+            {"part": int(ids[i]), "name": self.names.get(int(ids[i])), "distance": float(distances[i])}
+            for i in nearest
+        ]
+
+index = SimilarityIndex()
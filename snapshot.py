@@ -0,0 +1,289 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy.orm import Session
+import models
+import percentiles
+import versions
+from config import snapshot_dir
+
+# Layout, all little-endian:
+#   header    magic, format version, file version, the versions.CATALOG it was exported at,
+#             then (offset, count) per section
+#   strings   count + 1 u32 offsets into the UTF-8 blob that follows them
+#   records   fixed-width rows, text fields are string indexes and -1 is NULL
+MAGIC = b"BXCS"
+FORMAT_VERSION = 3
+SECTIONS = ("strings", "types", "lines", "restrictions", "parts")
+HEADER = struct.Struct("<4sHxxQQ" + "II" * len(SECTIONS))
+STRING_OFFSET = struct.Struct("<I")
+NAMED = struct.Struct("<ii")
+PART = struct.Struct("<iiii" + "i" * len(percentiles.STAT_COLUMNS) + "b" * len(percentiles.STAT_COLUMNS))
+NULL = -1
+NO_STAT = -2**31
+POINTER = "catalog.current"
+LOCK = "catalog.lock"
+CHECK_SECONDS = 1.0
+KEEP_SNAPSHOTS = 3
+# Admin writes landing within this window share one export
+EXPORT_DELAY = 0.5
+RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+def pointed_version(directory: str) -> int:
+    try:
+        with open(os.path.join(directory, POINTER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return 0
+    return int(name[len("catalog-"):-len(".bxcs")])
+
+@contextmanager
+def _exclusive(directory: str):
+    with open(os.path.join(directory, LOCK), "a+b") as lock:
+        try:
+            import fcntl
+        except ImportError:
+            # Windows has no fcntl, lock the first byte instead
+            import msvcrt
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def export(db: Session, directory: str) -> str:
+    # One export at a time across workers, so the catalog is read and published in order
+    with _exclusive(directory):
+        return _export(db, directory)
+
+def _export(db: Session, directory: str) -> str:
+    # Read before the catalog itself, the file may hold newer rows than it claims but never older
+    catalog_version = versions.read(db, versions.CATALOG) or 0
+    strings = []
+    interned = {}
+
+    def intern(value):
+        if value is None:
+            return NULL
+        if value not in interned:
+            interned[value] = len(strings)
+            strings.append(value.encode("utf-8"))
+        return interned[value]
+
+    def null(value):
+        return NULL if value is None else value
+
+    types = [NAMED.pack(row.id, intern(row.name)) for row in db.query(models.PartTypes).order_by(models.PartTypes.id)]
+    lines = [NAMED.pack(row.id, intern(row.name)) for row in db.query(models.Lines).order_by(models.Lines.id)]
+    restrictions = [NAMED.pack(row.id, intern(row.description)) for row in db.query(models.Restrictions).order_by(models.Restrictions.id)]
+    ranked = percentiles.for_parts(db)
+    parts = []
+    rows = (
+        db.query(models.Parts, models.Stats)
+        .join(models.Stats, models.Stats.id == models.Parts.stats)
+        .order_by(models.Parts.id)
+    )
+    for part, stats in rows:
+        part_ranks = {row.stat: row.percentile for row in ranked.get(part.id, [])}
+        parts.append(PART.pack(
+            part.id,
+            intern(part.name),
+            null(part.type),
+            null(part.restriction),
+            *[NO_STAT if getattr(stats, column) is None else getattr(stats, column) for column in percentiles.STAT_COLUMNS],
+            *[part_ranks.get(column, NULL) for column in percentiles.STAT_COLUMNS],
+        ))
+
+    string_offsets = [0]
+    for encoded in strings:
+        string_offsets.append(string_offsets[-1] + len(encoded))
+    string_section = b"".join(STRING_OFFSET.pack(offset) for offset in string_offsets) + b"".join(strings)
+
+    sections = [(string_section, len(strings))] + [(b"".join(records), len(records)) for records in (types, lines, restrictions, parts)]
+    layout = []
+    offset = HEADER.size
+    for body, count in sections:
+        layout += [offset, count]
+        offset += len(body)
+
+    # Always past the published version, even if the clock stepped back
+    version = max(time.time_ns(), pointed_version(directory) + 1)
+    name = f"catalog-{version}.bxcs"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, version, catalog_version, *layout))
+        for body, _ in sections:
+            f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    # Workers follow the pointer file, swapping it is what publishes the new version
+    with open(os.path.join(directory, POINTER + ".tmp"), "w") as f:
+        f.write(name)
+    os.replace(os.path.join(directory, POINTER + ".tmp"), os.path.join(directory, POINTER))
+
+    # Workers still mapping an older file keep it alive after the unlink
+    old = sorted(entry for entry in os.listdir(directory) if entry.startswith("catalog-") and entry.endswith(".bxcs"))
+    for entry in old[:-KEEP_SNAPSHOTS]:
+        os.remove(os.path.join(directory, entry))
+    return path
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        fields = HEADER.unpack_from(self.view)
+        magic, format_version, self.version, self.catalog_version = fields[:4]
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} catalog snapshot")
+        self.sections = {name: (fields[4 + 2 * i], fields[5 + 2 * i]) for i, name in enumerate(SECTIONS)}
+        offset, count = self.sections["strings"]
+        self.blob = offset + STRING_OFFSET.size * (count + 1)
+
+    def string(self, index: int):
+        if index == NULL:
+            return None
+        offset = self.sections["strings"][0] + STRING_OFFSET.size * index
+        start, = STRING_OFFSET.unpack_from(self.view, offset)
+        end, = STRING_OFFSET.unpack_from(self.view, offset + STRING_OFFSET.size)
+        return str(self.view[self.blob + start:self.blob + end], "utf-8")
+
+    def records(self, section: str, layout: struct.Struct):
+        offset, count = self.sections[section]
+        return layout.iter_unpack(self.view[offset:offset + count * layout.size])
+
+    def types(self):
+        return [{"id": id, "name": self.string(name)} for id, name in self.records("types", NAMED)]
+
+    def lines(self):
+        return [{"id": id, "name": self.string(name)} for id, name in self.records("lines", NAMED)]
+
+    def restrictions(self):
+        return [{"id": id, "description": self.string(description)} for id, description in self.records("restrictions", NAMED)]
+
+    def parts(self):
+        restrictions = {restriction["id"]: restriction for restriction in self.restrictions()}
+        width = len(percentiles.STAT_COLUMNS)
+        result = []
+        for id, name, type, restriction, *columns in self.records("parts", PART):
+            stats, ranks = columns[:width], columns[width:]
+            result.append({
+                "id": id,
+                "name": self.string(name),
+                "type": type,
+                "stats": {"id": id, **{column: None if value == NO_STAT else value for column, value in zip(percentiles.STAT_COLUMNS, stats)}},
+                "restriction": restrictions.get(restriction),
+                "percentiles": [
+                    {"stat": column, "percentile": rank, "tier": percentiles.tier(rank)}
+                    for column, rank in zip(percentiles.STAT_COLUMNS, ranks) if rank != NULL
+                ],
+            })
+        return result
+
+_lock = threading.Lock()
+_current = None
+_checked = 0.0
+_catalog_version = 0
+
+def current(db: Session):
+    """The mapped snapshot named by the pointer file, rechecked at most once per CHECK_SECONDS.
+
+    None while the snapshot is behind the database's catalog version, callers read the
+    database until an export catches up.
+    """
+    global _current, _checked, _catalog_version
+    if not snapshot_dir:
+        return None
+    now = time.monotonic()
+    if now - _checked >= CHECK_SECONDS:
+        with _lock:
+            _checked = now
+            _catalog_version = versions.read(db, versions.CATALOG) or 0
+            try:
+                with open(os.path.join(snapshot_dir, POINTER)) as f:
+                    name = f.read().strip()
+                if _current is None or _current.name != name:
+                    _current = Snapshot(os.path.join(snapshot_dir, name))
+            except (FileNotFoundError, ValueError):
+                # No export yet, pruned by a newer export we'll see next check, or an older format
+                pass
+    snapshot = _current
+    if snapshot is None or snapshot.catalog_version < _catalog_version:
+        return None
+    return snapshot
+
+_pending = threading.Lock()
+_scheduled = False
+_dirty = False
+
+def publish():
+    """Schedules an export of the committed catalog, other workers follow the pointer to it.
+
+    Exports run on a background thread and writes arriving while one is scheduled or running
+    share the next one, so a burst of admin writes costs one or two exports, not one each.
+    """
+    global _scheduled, _dirty, _checked
+    if not snapshot_dir:
+        return
+    with _pending:
+        _dirty = True
+        # This worker's write already moved the catalog version, notice it on the next read
+        _checked = 0.0
+        if _scheduled:
+            return
+        _scheduled = True
+    timer = threading.Timer(EXPORT_DELAY, _export_pending)
+    timer.daemon = True
+    timer.start()
+
+def _export_pending():
+    global _scheduled, _dirty, _checked
+    from database import SessionLocal
+    while True:
+        with _pending:
+            if not _dirty:
+                _scheduled = False
+                return
+            _dirty = False
+        db = SessionLocal()
+        try:
+            export(db, snapshot_dir)
+            _checked = 0.0
+        except Exception:
+            # Reads fall back to the database meanwhile, the snapshot being behind the catalog
+            logger.exception("Catalog snapshot export failed, retrying in %s seconds", RETRY_SECONDS)
+            with _pending:
+                _dirty = True
+            time.sleep(RETRY_SECONDS)
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        sys.exit("usage: python snapshot.py export [directory]")
+    from database import SessionLocal
+    directory = sys.argv[2] if len(sys.argv) > 2 else snapshot_dir
+    if not directory:
+        sys.exit("Set snapshot_dir in values.json or pass a directory")
+    db = SessionLocal()
+    try:
+        print(export(db, directory))
+    finally:
+        db.close()
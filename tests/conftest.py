@@ -0,0 +1,11 @@
+import json
+import os
+import sys
+import tempfile
+
+# config.py reads values.json on import, the index code under test never touches the database
+_values = os.path.join(tempfile.mkdtemp(), "values.json")
+with open(_values, "w") as f:
+    json.dump({"db_path": "sqlite://", "jwt_secret": "test", "port": 8000}, f)
+os.environ.setdefault("VALUES_PATH", _values)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
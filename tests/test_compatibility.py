@@ -0,0 +1,65 @@
+from compatibility import CompatibilityIndex, bits
+
+BLADE, RATCHET, BIT = 1, 2, 3
+
+def make_index():
+    # Part 1 carries restriction 10, which lists part 2. Parts 3 and 4 are unrestricted.
+    index = CompatibilityIndex()
+    index.set_part(1, BLADE, 10)
+    index.set_part(2, RATCHET)
+    index.set_part(3, RATCHET)
+    index.set_part(4, BIT)
+    index.add_rule(10, 2)
+    return index
+
+def test_bits():
+    assert list(bits(0)) == []
+    assert list(bits(0b101001)) == [0, 3, 5]
+
+def test_rule_is_symmetric():
+    index = make_index()
+    assert index.compatible(1, RATCHET) == [3]
+    assert index.compatible(2, BLADE) == []
+    assert index.compatible(3) == {BLADE: [1], RATCHET: [2], BIT: [4]}
+
+def test_check_reports_unknown_parts_and_conflicts():
+    index = make_index()
+    assert index.check([1, 3, 4]) == ([], [])
+    assert index.check([1, 2, 4]) == ([], [(1, 2)])
+    assert index.check([1, 9]) == ([9], [])
+
+def test_set_part_moves_restriction():
+    index = make_index()
+    index.set_part(1, BLADE, None)
+    index.set_part(3, RATCHET, 10)
+    assert index.check([1, 2]) == ([], [])
+    assert index.check([2, 3]) == ([], [(2, 3)])
+
+def test_set_part_moves_type():
+    index = make_index()
+    index.set_part(3, BIT)
+    assert index.compatible(1, RATCHET) == []
+    assert index.compatible(1, BIT) == [3, 4]
+
+def test_remove_listed_part_clears_carriers():
+    index = make_index()
+    index.remove_part(2)
+    assert index.incompatible[1] == 0
+    # A new part reusing the id isn't listed under the restriction
+    index.set_part(2, RATCHET)
+    assert index.check([1, 2]) == ([], [])
+
+def test_remove_carrier():
+    index = make_index()
+    index.remove_part(1)
+    assert index.incompatible[2] == 0
+    assert index.check([1, 2]) == ([1], [])
+
+def test_remove_rule_and_restriction():
+    index = make_index()
+    index.remove_rule(10, 2)
+    assert index.check([1, 2]) == ([], [])
+    index.add_rule(10, 2)
+    index.remove_restriction(10)
+    assert index.check([1, 2]) == ([], [])
+    assert index.part_restriction[1] is None
@@ -0,0 +1,20 @@
+import numpy as np
+from percentiles import rank, tier
+
+def test_ties_share_their_midpoint():
+    ranks = rank(np.array([[1.0], [2.0], [2.0], [3.0]]))
+    assert ranks[:, 0].tolist() == [12.5, 50.0, 50.0, 87.5]
+
+def test_missing_stats_stay_nan_and_are_not_counted():
+    ranks = rank(np.array([[1.0, np.nan], [np.nan, np.nan], [3.0, np.nan]]))
+    assert ranks[0, 0] == 25.0
+    assert np.isnan(ranks[1, 0])
+    assert ranks[2, 0] == 75.0
+    assert np.isnan(ranks[:, 1]).all()
+
+def test_columns_rank_independently():
+    ranks = rank(np.array([[1.0, 20.0], [2.0, 10.0]]))
+    assert ranks.tolist() == [[25.0, 75.0], [75.0, 25.0]]
+
+def test_tier_floors():
+    assert [tier(p) for p in (0, 14, 15, 39, 40, 69, 70, 89, 90, 100)] == ["D", "D", "C", "C", "B", "B", "A", "A", "S", "S"]
@@ -0,0 +1,49 @@
+from trades import TradeIndex
+
+def make_index(owned):
+    index = TradeIndex()
+    index.version = 0
+    for owner, parts in owned.items():
+        for part_id, copies in parts.items():
+            index.set_copies(owner, part_id, copies, index.version + 1)
+    return index
+
+def test_partners_swap_spares_the_other_lacks():
+    index = make_index({1: {1: 2, 2: 1}, 2: {3: 2}, 3: {1: 1, 3: 2}})
+    # User 3 already owns part 1, so only user 2 needs it
+    assert index.partners(1) == [{"user": 2, "give": [1], "get": [3]}]
+    assert index.partners(2) == [{"user": 1, "give": [3], "get": [1]}]
+
+def test_no_spares_no_partners():
+    index = make_index({1: {1: 1}, 2: {2: 2}})
+    assert index.partners(1) == []
+    assert index.partners(2) == []
+
+def test_partners_ranked_by_smaller_side_then_total():
+    index = make_index({
+        1: {1: 2, 2: 2},
+        2: {3: 2},
+        3: {4: 2, 5: 2},
+        4: {6: 2, 7: 2, 8: 2},
+    })
+    assert [match["user"] for match in index.partners(1)] == [4, 3, 2]
+    assert [match["user"] for match in index.partners(1, limit=1)] == [4]
+
+def test_set_copies_dropping_to_one_clears_spare():
+    index = make_index({1: {1: 2}, 2: {2: 2}})
+    index.set_copies(1, 1, 1, index.version + 1)
+    assert index.partners(2) == []
+
+def test_set_copies_ignores_writes_it_already_loaded():
+    index = make_index({1: {1: 2}})
+    index.set_copies(1, 1, 3, index.version)
+    assert index.counts[1][1] == 2
+
+def test_set_copies_leaves_gaps_to_a_reload():
+    index = make_index({1: {1: 2}})
+    version = index.version
+    index.checked = 1.0
+    index.set_copies(1, 1, 5, version + 2)
+    assert index.counts[1][1] == 2
+    assert index.version == version
+    assert index.checked == 0.0
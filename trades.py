@@ -0,0 +1,115 @@
+import heapq
+import threading
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import models
+import versions
+from compatibility import bits
+
+# Per user: part -> copies owned, plus bitsets (one bit per part id) of
+# everything owned and of the parts owned more than once.
+
+def copies(db: Session, owner: int, part_id: int) -> int:
+    return db.query(func.count()).select_from(models.Ownerships).filter(models.Ownerships.owner == owner, models.Ownerships.part == part_id).scalar()
+
+class TradeIndex(versions.VersionedIndex):
+    version_name = versions.OWNERSHIP
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.owned = {}
+        self.spare = {}
+
+    def load(self, db: Session):
+        version = versions.read(db, self.version_name)
+        counts = {}
+        rows = (
+            db.query(models.Ownerships.owner, models.Ownerships.part, func.count())
+            .filter(models.Ownerships.owner.isnot(None), models.Ownerships.part.isnot(None))
+            .group_by(models.Ownerships.owner, models.Ownerships.part)
+        )
+        for owner, part_id, copies in rows:
+            counts.setdefault(owner, {})[part_id] = copies
+        with self.lock:
+            self.counts = counts
+            self.owned = {}
+            self.spare = {}
+            for owner in counts:
+                self._index(owner)
+            self.version = version
+
+    def _index(self, owner):
+        owned = spare = 0
+        for part_id, copies in self.counts.get(owner, {}).items():
+            owned |= 1 << part_id
+            if copies > 1:
+                spare |= 1 << part_id
+        self.owned[owner] = owned
+        self.spare[owner] = spare
+
+    def _set(self, owner, part_id, copies):
+        parts = self.counts.setdefault(owner, {})
+        bit = 1 << part_id
+        if copies > 0:
+            parts[part_id] = copies
+            self.owned[owner] = self.owned.get(owner, 0) | bit
+        else:
+            parts.pop(part_id, None)
+            self.owned[owner] = self.owned.get(owner, 0) & ~bit
+        if copies > 1:
+            self.spare[owner] = self.spare.get(owner, 0) | bit
+        else:
+            self.spare[owner] = self.spare.get(owner, 0) & ~bit
+
+    def set_copies(self, owner: int, part_id: int, copies: int, version: int):
+        """Patches in this worker's own ownership write, copies counted after its commit."""
+        with self.lock:
+            # A count is absolute, so a reload that already picked the write up is harmless,
+            # but a gap means other workers' writes are missing and only a reload fixes that
+            if self.version == version - 1:
+                self._set(owner, part_id, copies)
+                self.version = version
+            elif self.version is not None and self.version < version:
+                self.checked = 0.0
+
+    def remove_user(self, owner: int):
+        with self.lock:
+            self.counts.pop(owner, None)
+            self.owned.pop(owner, None)
+            self.spare.pop(owner, None)
+
+    def remove_parts(self, part_ids):
+        with self.lock:
+            for owner, parts in self.counts.items():
+                if any(part_id in parts for part_id in part_ids):
+                    for part_id in part_ids:
+                        parts.pop(part_id, None)
+                    self._index(owner)
+
+    def partners(self, owner: int, limit: int = 10):
+        """Users who own none of a part I have spare copies of, and have spares of parts I don't own."""
+        with self.lock:
+            mine = self.owned.get(owner, 0)
+            my_spare = self.spare.get(owner, 0)
+            if not my_spare:
+                return []
+            candidates = []
+            for other, their_spare in self.spare.items():
+                if other == owner or not their_spare:
+                    continue
+                get = their_spare & ~mine
+                if not get:
+                    continue
+                give = my_spare & ~self.owned[other]
+                if give:
+                    candidates.append((other, give, get))
+        ranked = heapq.nlargest(
+            limit,
+            candidates,
+            key=lambda match: (min(match[1].bit_count(), match[2].bit_count()), match[1].bit_count() + match[2].bit_count()),
+        )
+        return [{"user": other, "give": list(bits(give)), "get": list(bits(get))} for other, give, get in ranked]
+
+index = TradeIndex()
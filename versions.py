@@ -0,0 +1,64 @@
+import time
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+from config import index_refresh_seconds
+
+# Each worker keeps its own in-memory indexes. Writers bump a shared counter row in the
+# same transaction as their change, and every worker reloads an index once it sees the
+# counter move past the version it loaded.
+
+CATALOG = "catalog"
+OWNERSHIP = "ownership"
+
+def ensure(db: Session):
+    for name in (CATALOG, OWNERSHIP):
+        if db.query(models.IndexVersions.name).filter(models.IndexVersions.name == name).first():
+            continue
+        db.add(models.IndexVersions(name=name, version=0))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker seeded it first
+            db.rollback()
+
+def bump(db: Session, name: str):
+    return db.execute(
+        update(models.IndexVersions)
+        .where(models.IndexVersions.name == name)
+        .values(version=models.IndexVersions.version + 1)
+        .returning(models.IndexVersions.version)
+    ).scalar()
+
+def read(db: Session, name: str):
+    return db.query(models.IndexVersions.version).filter(models.IndexVersions.name == name).scalar()
+
+class VersionedIndex:
+    """Base for per-worker indexes, subclasses set version_name and implement load(db)."""
+    version_name = None
+
+    def __init__(self):
+        self.version = None
+        self.checked = 0.0
+
+    def refresh(self, db: Session):
+        now = time.monotonic()
+        if now - self.checked < index_refresh_seconds:
+            return
+        self.checked = now
+        # Only ever move forward, a lagging replica's older version must not roll the index back
+        stored = read(db, self.version_name)
+        if stored is not None and (self.version is None or stored > self.version):
+            self.load(db)
+
+    def applied(self, version):
+        # This worker already patched in its own write, only skip the reload when
+        # no other worker's write came in between
+        if version is None:
+            return
+        if self.version == version - 1:
+            self.version = version
+        elif self.version is not None and self.version < version:
+            # Another worker's write is missing, reload on the next refresh
+            self.checked = 0.0